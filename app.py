@@ -1,93 +1,156 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine
+import numpy as np
+from pandas.api.types import CategoricalDtype
 from prophet import Prophet
-from prophet.make_holidays import make_holidays_df
+from prophet.serialize import model_to_json, model_from_json
 from datetime import timedelta
+from pathlib import Path
+import hashlib
 import altair as alt
+from db import (
+    get_engine, load_payment_data, load_coin_data, load_coin_total,
+    load_first_launch, load_cycle_data
+)
 
 # ── coin_top_n 상태 초기화 (앱 시작 시 1회 실행) ──────────────────────
 if "coin_top_n" not in st.session_state:
     st.session_state.coin_top_n = 10
 
-# ── 한국 공휴일 (Prophet 예측에 사용) ───────────────────────────────
-holidays_kr = make_holidays_df(year_list=[2024, 2025], country="KR")
-
-# ── RDS 연결 정보 (secrets.toml) ────────────────────────────────────
-user     = st.secrets["DB"]["DB_USER"]
-password = st.secrets["DB"]["DB_PASSWORD"]
-host     = st.secrets["DB"]["DB_HOST"]
-port     = st.secrets["DB"]["DB_PORT"]
-db       = st.secrets["DB"]["DB_NAME"]
-
-engine = create_engine(
-    f"mysql+pymysql://{user}:{password}@{host}:{port}/{db}?charset=utf8mb4",
-    pool_recycle=3600,
-    connect_args={"connect_timeout": 10}
-)
-
-# ── 연결 테스트 ────────────────────────────────────────────────────
+# 연결 테스트는 db.get_engine() 안에서 엔진 생성 시 1회만 수행
 try:
-    conn = engine.connect()
+    get_engine()
     st.success("✅ DB 연결 성공!")
-    conn.close()
 except Exception as e:
     st.error(f"❌ DB 연결 실패: {e}")
     st.stop()
 
 st.title("📊 웹툰 매출 & 결제 분석 대시보드 + 이벤트 인사이트")
 weekdays = ["Sunday","Monday","Tuesday","Wednesday","Thursday","Friday","Saturday"]
+weekday_dtype = CategoricalDtype(weekdays, ordered=True)
+
+# ── 계산 헬퍼 ───────────────────────────────────────────────────────
+def mean_median_mode(values):
+    """
+    값별 개수(counts) 한 번으로 평균·중앙값·최빈값을 함께 계산.
+    값 범위가 좁은 정수(주기 일수)는 np.bincount 로 정렬 없이, 그 외는 정렬 1회(np.unique)로 계산.
+    결측값은 제외하고, 최빈값이 여러 개면 가장 작은 값 (pandas mode().iat[0] 과 동일).
+    """
+    a = np.asarray(values)
+    if a.dtype.kind in "iu" and a.size and a.max() - a.min() <= max(a.size, 1 << 16):
+        base   = a.min()
+        counts = np.bincount(a - base)
+        uniq   = np.arange(len(counts), dtype=np.float64) + base
+    else:
+        a = a.astype(np.float64)
+        a = a[~np.isnan(a)]
+        uniq, counts = np.unique(a, return_counts=True)
+    cum = np.cumsum(counts)
+    n   = cum[-1]
+    mean   = (uniq * counts).sum() / n
+    lo     = uniq[np.searchsorted(cum, (n - 1) // 2, side="right")]
+    hi     = uniq[np.searchsorted(cum, n // 2, side="right")]
+    median = (lo + hi) / 2
+    mode   = uniq[counts.argmax()]
+    return mean, median, mode
 
-# ── 데이터 로드 함수 정의 ───────────────────────────────────────────
 @st.cache_data
-def load_coin_data():
-    df = pd.read_sql("SELECT date, Title, Total_coins FROM purchase_bomkr", con=engine)
-    df["Total_coins"] = pd.to_numeric(df["Total_coins"], errors="coerce").fillna(0).astype(int)
-    df["date"]       = pd.to_datetime(df["date"], errors="coerce")
+def prep_pay(df):
+    """
+    임계치와 무관한 전처리(weekday 범주형 변환, 평균 대비 배수)만 미리 해서 캐시.
+    임계치 변경 시에는 이벤트 비교만 다시 수행.
+    (날짜 정렬은 load_payment_data 의 ORDER BY 에서 이미 됨)
+    인자로 받은 프레임은 수정하지 않도록 복사본에 컬럼을 씀.
+    """
+    df = df.copy()
+    # amount 는 Prophet 학습·차트에도 쓰이므로 float64 그대로 둠
+    df["weekday"] = df["weekday"].astype(weekday_dtype)
+    df["rate"]    = df["amount"] / df["rolling_avg"]
     return df
 
 @st.cache_data
-def load_payment_data(start_date=None, end_date=None):
+def weekday_bar_spec(df, field, color, y_title):
     """
-    start_date, end_date 가 None 이면 전체,
-    문자열로 넘어오면 그 기간만 SQL 레벨에서 필터해서 반환.
+    요일별 막대 차트의 Vega-Lite spec(dict) 을 캐시.
+    df 내용이 같으면 Altair 차트 생성/직렬화를 건너뜀.
     """
-    if start_date and end_date:
-        sql = f"""
-        SELECT
-          `date`,
-          SUM(amount) AS amount,
-          SUM(CASE WHEN payment_count = 1 THEN 1 ELSE 0 END) AS first_count
-        FROM payment_bomkr
-        WHERE `date` BETWEEN '{start_date}' AND '{end_date}'
-        GROUP BY `date`
-        """
-    else:
-        sql = """
-        SELECT
-          `date`,
-          SUM(amount) AS amount,
-          SUM(CASE WHEN payment_count = 1 THEN 1 ELSE 0 END) AS first_count
-        FROM payment_bomkr
-        GROUP BY `date`
-        """
-
-    df = pd.read_sql(sql, con=engine)
-    df["date"] = pd.to_datetime(df["date"], format="%Y-%m-%d", errors="coerce")
-
-    bad = df["date"].isna()
-    bad_rows = df.loc[bad, :].copy()
-    df = df.loc[~bad, :].reset_index(drop=True)
+    return alt.Chart(df).mark_bar(color=color).encode(
+        x=alt.X("weekday:N", sort=weekdays, title="요일"),
+        y=alt.Y(f"{field}:Q", title=y_title),
+        tooltip=["weekday", field]
+    ).properties(height=250).to_dict()
 
-    return df, bad_rows
-
-# ── 1) 전체 결제 데이터 로드 & 파싱 에러 알림 ────────────────────────
-pay_df, bad_rows = load_payment_data()
-if not bad_rows.empty:
-    st.warning(f"⚠️ 날짜 파싱 실패 {len(bad_rows):,}건 → 해당 행들은 제거됩니다")
-    st.write("❗ 파싱 실패 원본 예시:", bad_rows.head())
+def prophet_key(df):
+    """
+    Prophet 캐시 키. 전체 해시 대신 (시작일, 마지막일, 행 수, y 합계) 만 사용해 O(1) 에 가깝게.
+    """
+    return (str(df["ds"].iloc[0]), str(df["ds"].iloc[-1]), len(df), float(df["y"].sum()))
+
+# 학습된 Prophet 모델의 로컬 JSON 캐시 (프로세스 재시작 후에도 재학습하지 않도록)
+MODEL_CACHE_DIR = Path("~/.cache/nextsales").expanduser()
+# 최근에 쓰인 모델 파일만 이 개수만큼 남김 (다른 세션/프로세스가 쓰는 모델은 지우지 않도록 여유 있게)
+MODEL_CACHE_KEEP = 8
+
+# 모델 설정 / 공휴일 국가 / 학습 인자. 바뀌면 예전 설정의 모델을 쓰지 않도록 디스크 캐시 키에 모두 포함
+# - 차트는 yhat 만 쓰므로 yhat_lower/upper 용 불확실성 샘플링은 끔
+# - 일 단위 데이터에는 일중(daily) 계절성이 없으므로 명시적으로 끔
+# - 일 단위 데이터라 LBFGS 기본 반복(10000) 전에 수렴함
+PROPHET_MODEL_ARGS = {"uncertainty_samples": 0, "daily_seasonality": False}
+PROPHET_HOLIDAYS   = "KR"
+PROPHET_FIT_ARGS   = {"algorithm": "LBFGS", "iter": 1000}
+
+# DataFrame 인자는 prophet_key 로만 해시 (전체 프레임 해시 생략)
+@st.cache_resource(show_spinner="Prophet 모델 학습 중...", hash_funcs={pd.DataFrame: prophet_key})
+def fit_prophet(df):
+    """
+    Prophet 학습은 rerun 마다 반복하지 않고 입력 데이터가 바뀔 때만 수행.
+    모델 객체는 pickle 하지 않도록 cache_resource 로 참조만 보관.
+    모든 세션이 같은 모델을 공유하지만, 결제 테이블 자체가 전역 데이터이고
+    모델은 학습 후 읽기 전용으로만 쓰므로 문제 없음.
+    같은 키로 학습한 모델이 디스크에 있으면 학습 없이 불러옴.
+    """
+    settings   = (PROPHET_MODEL_ARGS, PROPHET_HOLIDAYS, PROPHET_FIT_ARGS)
+    key        = hashlib.blake2b(repr((prophet_key(df), settings)).encode(), digest_size=8).hexdigest()
+    model_path = MODEL_CACHE_DIR / f"prophet_{key}.json"
+    if model_path.exists():
+        try:
+            m = model_from_json(model_path.read_text())
+        except (OSError, ValueError, KeyError):
+            m = None  # 깨졌거나 다른 버전으로 저장된 파일이면 다시 학습
+        if m is not None:
+            try:
+                model_path.touch()  # 최근 사용 표시 (오래된 파일 정리 기준)
+            except OSError:
+                pass
+            return m
+
+    m = Prophet(**PROPHET_MODEL_ARGS)
+    m.add_country_holidays(country_name=PROPHET_HOLIDAYS)
+    m.fit(df, **PROPHET_FIT_ARGS)
+
+    try:
+        MODEL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        model_path.write_text(model_to_json(m))
+        # 결제 데이터가 매일 바뀌므로 파일이 쌓이지 않게, 최근 사용순으로 MODEL_CACHE_KEEP 개만 남기고 삭제
+        paths = sorted(MODEL_CACHE_DIR.glob("prophet_*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for old_path in paths[MODEL_CACHE_KEEP:]:
+            old_path.unlink(missing_ok=True)
+    except OSError:
+        pass
+    return m
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: prophet_key})
+def predict_prophet(df, periods):
+    """
+    학습 데이터와 예측 기간이 같으면 예측 결과를 재사용.
+    차트에 쓰는 ds, yhat 만 남겨서 캐시 크기를 줄임.
+    """
+    m = fit_prophet(df)
+    future = m.make_future_dataframe(periods=periods)
+    return m.predict(future)[["ds","yhat"]]
 
-coin_df = load_coin_data()
+# ── 1) 전체 결제 데이터 로드 ──────────────────────────────────────────
+pay_df = load_payment_data()
 
 # ── 2) 결제 매출 분석 ───────────────────────────────────────────────
 st.header("💳 결제 매출 분석")
@@ -106,54 +169,42 @@ if st.button("결제 임계치 적용"):
 st.caption(f"현재 결제 이벤트 임계치: {int(st.session_state.pay_thresh*100)}%")
 
 # rolling, 이벤트 플래그, 요일 분포 차트
-df_pay = pay_df.sort_values("date").reset_index(drop=True)
-df_pay["rolling_avg"] = df_pay["amount"].rolling(7, center=True, min_periods=1).mean()
-df_pay["event_flag"]  = df_pay["amount"] > df_pay["rolling_avg"] * st.session_state.pay_thresh
-df_pay["weekday"]     = df_pay["date"].dt.day_name()
-pay_counts = df_pay[df_pay["event_flag"]]["weekday"].value_counts()
+df_pay = prep_pay(pay_df)
+# 전체 길이 bool 컬럼 대신 이벤트 행 위치만 보관
+event_idx = np.flatnonzero(df_pay["amount"].values > df_pay["rolling_avg"].values * st.session_state.pay_thresh)
+
+# weekday 범주 코드(0=Sunday … 6=Saturday)로 바로 인덱싱해서 요일별 건수 / 배수 합계를 bincount 로 계산
+# 범주에 없는 값(코드 -1)은 제외 (groupby 때처럼 집계에서 빠지도록)
+ev_wd      = df_pay["weekday"].cat.codes.to_numpy()[event_idx]
+ev_rate    = df_pay["rate"].to_numpy(dtype=np.float64)[event_idx]
+valid      = ev_wd >= 0
+pay_counts = np.bincount(ev_wd[valid], minlength=7)
+rate_sums  = np.bincount(ev_wd[valid], weights=ev_rate[valid], minlength=7)
 
 st.subheader("🌟 결제 이벤트 발생 요일 분포")
-df_ev = pd.DataFrame({
-    "weekday": weekdays,
-    "count":   [pay_counts.get(d, 0) for d in weekdays]
-})
-chart_ev = alt.Chart(df_ev).mark_bar(color="blue").encode(
-    x=alt.X("weekday:N", sort=weekdays, title="요일"),
-    y=alt.Y("count:Q",    title="이벤트 횟수"),
-    tooltip=["weekday","count"]
-).properties(height=250)
-st.altair_chart(chart_ev, use_container_width=True)
+df_ev = pd.DataFrame({"weekday": weekdays, "count": pay_counts})
+st.vega_lite_chart(weekday_bar_spec(df_ev[["weekday","count"]], "count", "blue", "이벤트 횟수"), use_container_width=True)
 
 st.subheader("💹 요일별 평균 이벤트 증가 배수")
-rates = []
-for d in weekdays:
-    sub = df_pay[(df_pay["weekday"]==d)&(df_pay["event_flag"])]
-    rates.append((sub["amount"]/sub["rolling_avg"]).mean() if not sub.empty else 0)
-df_ev["rate"] = rates
-chart_rate = alt.Chart(df_ev).mark_bar(color="cyan").encode(
-    x=alt.X("weekday:N", sort=weekdays, title="요일"),
-    y=alt.Y("rate:Q",     title="평균 배수"),
-    tooltip=["weekday","rate"]
-).properties(height=250)
-st.altair_chart(chart_rate, use_container_width=True)
+df_ev["rate"] = np.divide(rate_sums, pay_counts, out=np.zeros(7), where=pay_counts > 0)
+st.vega_lite_chart(weekday_bar_spec(df_ev[["weekday","rate"]], "rate", "cyan", "평균 배수"), use_container_width=True)
+
+# 최근 3개월 구간은 결제 추이 / 첫 결제 추이 차트가 함께 사용
+recent_pay = df_pay[df_pay["date"] >= df_pay["date"].max() - timedelta(days=90)].set_index("date")
 
 st.subheader("📈 최근 3개월 결제 추이")
-recent_pay = df_pay[df_pay["date"] >= df_pay["date"].max() - timedelta(days=90)]
-st.line_chart(recent_pay.set_index("date")["amount"])
-
-st.subheader("🔮 향후 15일 결제 예측 (한국 공휴일 포함)")
-prop_df = df_pay.rename(columns={"date":"ds","amount":"y"})
-m1 = Prophet()
-m1.add_country_holidays(country_name="KR")
-m1.fit(prop_df)
-future = m1.make_future_dataframe(periods=15)
-fc     = m1.predict(future)
-pay_fc = fc[fc["ds"] > df_pay["date"].max()]
-st.line_chart(pay_fc.set_index("ds")["yhat"])
+st.line_chart(recent_pay["amount"])
+
+# Prophet 학습/예측은 가장 무거운 구간이라 사용자가 요청했을 때만 실행
+with st.expander("🔮 향후 15일 결제 예측 (한국 공휴일 포함)", expanded=False):
+    if st.checkbox("예측 실행", key="run_prophet"):
+        prop_df = df_pay[["date","amount"]].rename(columns={"date":"ds","amount":"y"})
+        fc = predict_prophet(prop_df, 15)
+        pay_fc = fc[fc["ds"] > df_pay["date"].max()]
+        st.line_chart(pay_fc.set_index("ds")["yhat"])
 
 st.subheader("🚀 첫 결제 추이 (최근 3개월)")
-recent_fc = df_pay[df_pay["date"] >= df_pay["date"].max() - timedelta(days=90)]
-st.line_chart(recent_fc.set_index("date")["first_count"])
+st.line_chart(recent_pay["first_count"])
 
 # ── 3) 코인 매출 분석 ───────────────────────────────────────────────
 st.header("🪙 코인 매출 분석")
@@ -161,19 +212,17 @@ st.header("🪙 코인 매출 분석")
 coin_date_range = st.date_input("코인 분석 기간 설정", [], key="coin_date")
 if len(coin_date_range) == 2:
     s, e = map(pd.to_datetime, coin_date_range)
-    df_p = coin_df[(coin_df["date"]>=s)&(coin_df["date"]<=e)]
+    coin_start, coin_end = s.strftime("%Y-%m-%d"), e.strftime("%Y-%m-%d")
 
-    # 1) 전체 사용 코인
-    total_coins = int(df_p["Total_coins"].sum())
+    # 1) 전체 사용 코인 / 작품 수
+    total_coins, n_titles = load_coin_total(coin_start, coin_end)
 
-    # 2) 작품별 합산 후 내림차순 정렬
-    coin_sum = df_p.groupby("Title")["Total_coins"] \
-                   .sum() \
-                   .sort_values(ascending=False)
-
-    # 3) Top N 설정
+    # 2) Top N 설정
     top_n = st.session_state.coin_top_n
-    top_n_sum = int(coin_sum.head(top_n).sum())
+
+    # 3) 기간 내 작품별 합산 Top N (SQL 에서 정렬 + LIMIT)
+    top_df    = load_coin_data(coin_start, coin_end, top_n)
+    top_n_sum = int(top_df["Total_coins"].sum())
 
     # 4) 비율 계산
     ratio = top_n_sum / total_coins if total_coins else 0
@@ -184,43 +233,29 @@ if len(coin_date_range) == 2:
         f"{top_n_sum:,} / {total_coins:,} ({ratio:.1%})"
     )
 
-    coin_sum     = df_p.groupby("Title")["Total_coins"].sum().sort_values(ascending=False)
-    total_coins  = int(coin_sum.sum())
-    first_launch = coin_df.groupby("Title")["date"].min()
+    first_launch = load_first_launch()
 
-    top_n = st.session_state.coin_top_n
     # Top N DataFrame 준비
-    top_df = coin_sum.head(top_n).reset_index(name="Total_coins")
     top_df.insert(0, "Rank", range(1, len(top_df)+1))
-    top_df["Launch Date"] = top_df["Title"].map(first_launch).dt.strftime("%Y-%m-%d")
-    top_df["is_new"]      = pd.to_datetime(top_df["Launch Date"]) >= s
-
-    # hl 함수 수정: disp가 아니라 top_df를 참조
-    def hl(row):
-        is_new = top_df.loc[row.name, "is_new"]
-        return [
-            "color: yellow" if (col == "Title" and is_new) else ""
-            for col in row.index
-        ]
-
-    # 스타일링할 컬럼만 disp에 복사
+    launch = top_df["Title"].map(first_launch)
+    top_df["Launch Date"] = launch.dt.strftime("%Y-%m-%d")
+    top_df["is_new"]      = launch >= s
+
+    # 신규 작품 강조: Styler HTML 대신 Title 앞에 🆕 표시를 붙이고 st.dataframe(Arrow 전송)으로 렌더링
+    new_mask = top_df["is_new"].to_numpy(dtype=bool)
     disp = top_df[["Rank","Title","Total_coins","Launch Date"]].copy()
-    styled = (
-        disp.style
-            .apply(hl, axis=1)
-            .format({"Total_coins":"{:,}"})
-            .set_table_styles([
-                {"selector":"th","props":[("text-align","center")]},
-                {"selector":"td","props":[("text-align","center")]},
-                {"selector":"th.row_heading, th.blank","props":[("display","none")]}
-            ])
-    )
-    st.markdown(
-        styled.to_html(index=False, escape=False),
-        unsafe_allow_html=True
+    disp["Title"] = np.where(new_mask, "🆕 " + disp["Title"].astype(str), disp["Title"].astype(str))
+    st.dataframe(
+        disp,
+        column_config={
+            "Total_coins": st.column_config.NumberColumn(format="localized"),
+            "Title":       st.column_config.TextColumn(),
+        },
+        hide_index=True,
+        use_container_width=True
     )
 
-    if len(coin_sum) > top_n:
+    if n_titles > top_n:
         if st.button("더보기", key="btn_coin_more"):
             st.session_state.coin_top_n += 10
 
@@ -238,30 +273,7 @@ if submit:
         start = dr[0].strftime("%Y-%m-%d")
         end   = dr[1].strftime("%Y-%m-%d")
 
-        df_raw, _ = load_payment_data(start, end)
-        df_raw = pd.read_sql(
-            f"""
-            SELECT user_id, platform, payment_count, amount, date
-            FROM payment_bomkr
-            WHERE date BETWEEN '{start}' AND '{end}'
-            """,
-            con=engine
-        )
-        df_raw["date"] = pd.to_datetime(df_raw["date"])
-        df_filt = df_raw[df_raw["payment_count"].isin([k, m])]
-
-        df_k = (
-            df_filt[df_filt["payment_count"]==k]
-            .set_index("user_id")[["date","amount","platform"]]
-            .rename(columns={"date":"d_k","amount":"a_k"})
-        )
-        df_m = (
-            df_filt[df_filt["payment_count"]==m]
-            .set_index("user_id")[["date","amount"]]
-        )
-        df_m.columns = ["d_m","a_m"]
-
-        joined = df_k.join(df_m, how="inner")
+        joined = load_cycle_data(start, end, int(k), int(m))
         joined["cycle"] = (joined["d_m"] - joined["d_k"]).dt.days
 
         cycles      = joined["cycle"]
@@ -269,8 +281,16 @@ if submit:
         plat_counts = joined["platform"].value_counts()
         mapping     = {"M":"Mobile Web","W":"PC Web","P":"Android","A":"Apple"}
 
-        st.success(f"주기 → 평균:{cycles.mean():.1f}일 | 중앙값:{cycles.median():.1f}일 | 최빈값:{cycles.mode().iat[0]:.1f}일")
-        st.success(f"금액 → 평균:{amt_ser.mean():.2f} | 중앙값:{amt_ser.median():.2f} | 최빈값:{amt_ser.mode().iat[0]:.2f}")
-        st.success("플랫폼 → " + ", ".join(f"{mapping.get(p,p)}:{cnt}건 ({cnt/len(joined):.1%})" for p,cnt in plat_counts.items()))
+        c_mean, c_med, c_mode = mean_median_mode(cycles)
+        a_mean, a_med, a_mode = mean_median_mode(amt_ser)
+
+        st.success(f"주기 → 평균:{c_mean:.1f}일 | 중앙값:{c_med:.1f}일 | 최빈값:{c_mode:.1f}일")
+        st.success(f"금액 → 평균:{a_mean:.2f} | 중앙값:{a_med:.2f} | 최빈값:{a_mode:.2f}")
+        plat_pct    = (plat_counts / len(joined) * 100).round(1)
+        # platform 은 범주형이라 map 결과도 범주형이 되므로 문자열로 바꾼 뒤 라벨 생성
+        plat_codes  = plat_counts.index.astype(str).to_series(index=plat_counts.index)
+        plat_labels = plat_codes.map(mapping).fillna(plat_codes)
+        plat_line   = plat_labels + ":" + plat_counts.astype(str) + "건 (" + plat_pct.astype(str) + "%)"
+        st.success("플랫폼 → " + ", ".join(plat_line.tolist()))
     else:
         st.error("❗️ 시작일과 종료일을 모두 선택해주세요.")
@@ -0,0 +1,351 @@
+# DB 엔진과 데이터 로드 함수 모음.
+# app.py 와 pages/*.py 가 같은 커넥션 풀과 cache_data 항목을 공유하도록 여기서 한 번만 정의
+import streamlit as st
+import pandas as pd
+import numpy as np
+import os
+import json
+from pathlib import Path
+from sqlalchemy import create_engine, text
+
+# ── RDS 연결 정보 (secrets.toml) ────────────────────────────────────
+user     = st.secrets["DB"]["DB_USER"]
+password = st.secrets["DB"]["DB_PASSWORD"]
+host     = st.secrets["DB"]["DB_HOST"]
+port     = st.secrets["DB"]["DB_PORT"]
+db       = st.secrets["DB"]["DB_NAME"]
+
+# 엔진(커넥션 풀)은 프로세스당 1개만 만들어 모든 세션/rerun 이 공유.
+# 연결 테스트(SELECT 1)도 엔진 생성 시 1회만 수행 (실패하면 캐시되지 않아 다음 rerun 에 재시도)
+@st.cache_resource
+def get_engine():
+    engine = create_engine(
+        f"mysql+pymysql://{user}:{password}@{host}:{port}/{db}?charset=utf8mb4",
+        pool_size=10,
+        max_overflow=20,
+        pool_timeout=30,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        connect_args={"connect_timeout": 10}
+    )
+    with engine.connect() as c:
+        c.execute(text("SELECT 1"))
+    return engine
+
+# ── 데이터 로드 함수 정의 ───────────────────────────────────────────
+def read_sql_chunked(sql, chunksize=200_000, **kwargs):
+    """
+    서버사이드 커서(stream_results)로 chunksize 행씩 받아서 이어붙임.
+    결과 전체를 클라이언트 메모리에 한 번에 올리지 않아 피크 메모리가 줄어듦.
+    """
+    with get_engine().connect().execution_options(stream_results=True) as conn:
+        chunks = pd.read_sql(sql, con=conn, chunksize=chunksize, **kwargs)
+        return pd.concat(chunks, ignore_index=True)
+
+@st.cache_data(ttl=3600)
+def load_coin_data(start_date, end_date, top_n):
+    """
+    start_date ~ end_date 기간의 작품별 코인 사용량 Top N 을
+    SQL 레벨에서 필터 + 집계 + 정렬 + LIMIT 해서 반환 (Title, Total_coins).
+    """
+    sql = text("""
+    SELECT
+      Title,
+      CAST(SUM(Total_coins) AS SIGNED) AS Total_coins
+    FROM purchase_bomkr
+    WHERE `date` BETWEEN :s AND :e
+    GROUP BY Title
+    ORDER BY SUM(Total_coins) DESC
+    LIMIT :n
+    """)
+    df = pd.read_sql(
+        sql, con=get_engine(),
+        params={"s": start_date, "e": end_date, "n": top_n},
+        dtype_backend="pyarrow"
+    )
+    # 숫자 변환 + 결측 0 채움 + int64 캐스팅을 한 번의 쓰기로 처리
+    df["Total_coins"] = pd.to_numeric(df["Total_coins"], errors="coerce").to_numpy(dtype=np.int64, na_value=0)
+    return df
+
+@st.cache_data(ttl=3600)
+def load_coin_total(start_date, end_date):
+    """
+    start_date ~ end_date 기간의 전체 코인 사용량과 작품 수 (1행 쿼리).
+    """
+    sql = text("""
+    SELECT
+      CAST(SUM(Total_coins) AS SIGNED) AS total_coins,
+      COUNT(DISTINCT Title)            AS n_titles
+    FROM purchase_bomkr
+    WHERE `date` BETWEEN :s AND :e
+    """)
+    row = pd.read_sql(sql, con=get_engine(), params={"s": start_date, "e": end_date}).iloc[0]
+    total = int(row["total_coins"]) if pd.notna(row["total_coins"]) else 0
+    return total, int(row["n_titles"])
+
+@st.cache_data(ttl=3600)
+def load_first_launch():
+    """
+    작품별 최초 코인 사용일 (= 런칭일). 기간 설정과 무관하므로 따로 캐시.
+    """
+    sql = """
+    SELECT
+      Title,
+      MIN(`date`) AS first_date
+    FROM purchase_bomkr
+    GROUP BY Title
+    """
+    df = pd.read_sql(
+        sql, con=get_engine(),
+        parse_dates={"first_date": "ISO8601"},
+        dtype_backend="pyarrow"
+    )
+    return df.set_index("Title")["first_date"]
+
+# 콘텐츠 매출 페이지(pages/contents_sales.py) 용: purchase_log_bomkr 의 g/b 코인 - 취소분으로 집계
+@st.cache_data(ttl=3600)
+def load_content_coin_data(start_date, end_date, top_n):
+    """
+    purchase_log_bomkr 기준 load_coin_data.
+    start_date ~ end_date 기간의 작품별 코인 사용량 Top N 을
+    SQL 레벨에서 필터 + 집계 + 정렬 + LIMIT 해서 반환 (Title, Total_coins).
+    """
+    sql = text("""
+    SELECT
+        `title`      AS Title,
+        CAST(SUM(IFNULL(g_coin,0)  - IFNULL(g_coin_cncl,0)
+               + IFNULL(b_coin,0)  - IFNULL(b_coin_cncl,0)) AS SIGNED) AS Total_coins
+    FROM `purchase_log_bomkr`
+    WHERE `date` BETWEEN :s AND :e
+    GROUP BY `title`
+    ORDER BY Total_coins DESC
+    LIMIT :n
+    """)
+    return pd.read_sql(
+        sql, con=get_engine(),
+        params={"s": start_date, "e": end_date, "n": top_n},
+        dtype_backend="pyarrow"
+    )
+
+@st.cache_data(ttl=3600)
+def load_content_coin_total(start_date, end_date):
+    """
+    purchase_log_bomkr 기준 load_coin_total.
+    start_date ~ end_date 기간의 전체 코인 사용량과 작품 수 (1행 쿼리).
+    """
+    sql = text("""
+    SELECT
+        CAST(SUM(IFNULL(g_coin,0)  - IFNULL(g_coin_cncl,0)
+               + IFNULL(b_coin,0)  - IFNULL(b_coin_cncl,0)) AS SIGNED) AS total_coins,
+        COUNT(DISTINCT `title`) AS n_titles
+    FROM `purchase_log_bomkr`
+    WHERE `date` BETWEEN :s AND :e
+    """)
+    row = pd.read_sql(sql, con=get_engine(), params={"s": start_date, "e": end_date}).iloc[0]
+    total = int(row["total_coins"]) if pd.notna(row["total_coins"]) else 0
+    return total, int(row["n_titles"])
+
+@st.cache_data(ttl=3600)
+def load_content_first_launch():
+    """
+    purchase_log_bomkr 기준 load_first_launch.
+    작품별 최초 코인 사용일 (= 런칭일). 기간 설정과 무관하므로 따로 캐시.
+    """
+    sql = """
+    SELECT
+        `title`      AS Title,
+        MIN(`date`)  AS first_date
+    FROM `purchase_log_bomkr`
+    GROUP BY `title`
+    """
+    df = pd.read_sql(
+        sql, con=get_engine(),
+        parse_dates={"first_date": "ISO8601"},
+        dtype_backend="pyarrow"
+    )
+    return df.set_index("Title")["first_date"]
+
+@st.cache_data
+def load_payment_data(start_date=None, end_date=None):
+    """
+    start_date, end_date 가 None 이면 전체,
+    문자열로 넘어오면 그 기간만 SQL 레벨에서 필터해서 반환.
+    7일 중심 이동평균(rolling_avg)은 SQL 윈도우 함수로 같이 계산.
+    (date 가 NULL 인 행은 이동평균 창에 섞이지 않도록 SQL 에서 제외)
+    결과는 SQL 에서 날짜순으로 정렬해서 받음.
+    """
+    if start_date and end_date:
+        sql = text("""
+        SELECT
+          `date`,
+          SUM(amount) AS amount,
+          SUM(payment_count = 1) AS first_count,
+          AVG(SUM(amount)) OVER (
+            ORDER BY `date` ROWS BETWEEN 3 PRECEDING AND 3 FOLLOWING
+          ) AS rolling_avg
+        FROM payment_bomkr
+        WHERE `date` BETWEEN :s AND :e
+        GROUP BY `date`
+        ORDER BY `date`
+        """)
+        params = {"s": start_date, "e": end_date}
+    else:
+        sql = """
+        SELECT
+          `date`,
+          SUM(amount) AS amount,
+          SUM(payment_count = 1) AS first_count,
+          AVG(SUM(amount)) OVER (
+            ORDER BY `date` ROWS BETWEEN 3 PRECEDING AND 3 FOLLOWING
+          ) AS rolling_avg
+        FROM payment_bomkr
+        WHERE `date` IS NOT NULL
+        GROUP BY `date`
+        ORDER BY `date`
+        """
+        params = None
+
+    df = pd.read_sql(
+        sql, con=get_engine(), params=params,
+        parse_dates={"date": "%Y-%m-%d"}
+    )
+    # amount 는 Prophet 학습·차트에도 쓰이므로 float64 로 두고,
+    # 이벤트 비교에만 쓰는 rolling_avg 만 float32 로 (메모리·대역폭 절반)
+    df["amount"]      = df["amount"].astype("float64")
+    df["rolling_avg"] = df["rolling_avg"].astype("float32")
+    # 일별 첫 결제 건수는 작은 정수라 가능한 가장 작은 정수형으로
+    df["first_count"] = pd.to_numeric(df["first_count"], downcast="integer")
+    df = df.dropna(subset=["date"]).reset_index(drop=True)
+    # 요일 이름은 서버 lc_time_names 설정에 따라 달라지는 DAYNAME() 대신 pandas 에서 생성
+    df["weekday"] = df["date"].dt.day_name()
+    return df
+
+@st.cache_data
+def load_daily_payment():
+    """
+    홈 요약용 일별 결제 합계 (date, amount).
+    이동평균/요일이 필요 없으므로 윈도우 함수 없이 합계만 조회.
+    """
+    sql = """
+    SELECT
+      `date`,
+      SUM(amount) AS amount
+    FROM payment_bomkr
+    WHERE `date` IS NOT NULL
+    GROUP BY `date`
+    ORDER BY `date`
+    """
+    df = pd.read_sql(
+        sql, con=get_engine(),
+        parse_dates={"date": "%Y-%m-%d"}
+    )
+    # 총 결제 금액을 표시하므로 float64 유지
+    df["amount"] = df["amount"].astype("float64")
+    return df.dropna(subset=["date"]).reset_index(drop=True)
+
+@st.cache_data(ttl=3600)
+def load_cycle_data(start_date, end_date, k, m):
+    """
+    기간 내 k번째 / m번째 결제를 모두 가진 유저만 반환.
+    self-join 대신 user_id 별 조건부 집계로 테이블을 한 번만 스캔.
+    (user_id, d_k, a_k, platform, d_m, a_m)
+    """
+    sql = text("""
+    SELECT
+      user_id,
+      MIN(CASE WHEN payment_count = :k THEN `date`   END) AS d_k,
+      MIN(CASE WHEN payment_count = :k THEN amount   END) AS a_k,
+      MIN(CASE WHEN payment_count = :k THEN platform END) AS platform,
+      MIN(CASE WHEN payment_count = :m THEN `date`   END) AS d_m,
+      MIN(CASE WHEN payment_count = :m THEN amount   END) AS a_m
+    FROM payment_bomkr
+    WHERE `date` BETWEEN :s AND :e
+      AND payment_count IN (:k, :m)
+    GROUP BY user_id
+    HAVING d_k IS NOT NULL AND d_m IS NOT NULL
+    """)
+    df = read_sql_chunked(
+        sql,
+        params={"s": start_date, "e": end_date, "k": k, "m": m},
+        parse_dates={"d_k": "%Y-%m-%d", "d_m": "%Y-%m-%d"},
+        dtype_backend="pyarrow"
+    )
+    # 플랫폼은 M/W/P/A 몇 종류뿐이라 정수 코드로 보관 (value_counts 가 코드 기준으로 동작)
+    df["platform"] = df["platform"].astype("category")
+    return df
+
+# 코인 원본의 로컬 Parquet 캐시 (서버 재시작 후에도 전체 테이블을 다시 받지 않도록)
+COIN_CACHE_DIR = Path("~/.cache/nextsales").expanduser()
+
+def _fetch_coin(since=None):
+    """
+    purchase_bomkr 에서 코인 사용 데이터 조회. since 가 있으면 그 날짜 이후분만.
+    """
+    sql = "SELECT date, Total_coins FROM purchase_bomkr"
+    params = None
+    if since is not None:
+        sql += " WHERE date >= :since"
+        params = {"since": since}
+    df = read_sql_chunked(
+        text(sql), params=params,
+        parse_dates={"date": "ISO8601"}
+    )
+    coins = pd.to_numeric(df["Total_coins"], errors="coerce").to_numpy(dtype=np.int64, na_value=0)
+    df["Total_coins"] = pd.to_numeric(coins, downcast="integer")
+    return df.dropna(subset=["date"])
+
+# 전체 이력이라 행 수가 많으므로 cache_data(직렬화 복사) 대신
+# cache_resource 에 1개만 보관하고, 호출 측에는 얕은 복사본을 넘김.
+# ttl 이 지나면 다시 MAX(date) 를 확인해서 새 날짜분만 이어받음
+@st.cache_resource(ttl=3600)
+def _load_coin_raw():
+    """
+    전체 코인 사용 데이터 로드.
+    MAX(date) 를 먼저 확인해서 로컬 Parquet 캐시가 최신이면 그대로 읽고,
+    아니면 캐시의 마지막 날짜부터만 DB 에서 다시 받아 이어붙인 뒤 저장.
+    (과거 날짜 데이터가 수정된 경우에는 캐시 파일을 지우면 전체를 다시 받음)
+    """
+    parquet_path = COIN_CACHE_DIR / "coin.parquet"
+    meta_path    = COIN_CACHE_DIR / "coin.json"
+
+    max_date = pd.read_sql("SELECT MAX(date) AS max_date FROM purchase_bomkr", con=get_engine()).iloc[0, 0]
+    if pd.isna(max_date):
+        return _fetch_coin()
+    max_date = str(max_date)
+
+    cached = None
+    if parquet_path.exists() and meta_path.exists():
+        # 쓰기 중단 등으로 파일이 깨졌으면 (ArrowInvalid 는 ValueError 하위) 캐시를 버리고 전체를 다시 받음
+        try:
+            last_date = json.loads(meta_path.read_text())["last_date"]
+            cached    = pd.read_parquet(parquet_path, engine="pyarrow")
+            cut       = pd.Timestamp(last_date)
+        except (OSError, ValueError, KeyError, TypeError):
+            cached = None
+
+    if cached is not None:
+        if last_date == max_date:
+            return cached
+        # 마지막 날짜는 당시 집계 중이었을 수 있으므로 그 날부터 다시 받음
+        cached = cached[cached["date"] < cut]
+        df = pd.concat([cached, _fetch_coin(since=last_date)], ignore_index=True)
+    else:
+        df = _fetch_coin()
+
+    # 임시 파일에 쓴 뒤 os.replace 로 교체해서 쓰다 만 파일이 남지 않게 함.
+    # Parquet 을 먼저 교체하므로 중간에 멈춰도 sentinel 은 항상 Parquet 보다 같거나 이전 날짜
+    # (이전 날짜면 다음 로드에서 그 날부터 다시 받으므로 결과는 같음)
+    try:
+        COIN_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_parquet = parquet_path.with_suffix(".parquet.tmp")
+        tmp_meta    = meta_path.with_suffix(".json.tmp")
+        df.to_parquet(tmp_parquet, engine="pyarrow", index=False)
+        os.replace(tmp_parquet, parquet_path)
+        tmp_meta.write_text(json.dumps({"last_date": max_date}))
+        os.replace(tmp_meta, meta_path)
+    except OSError:
+        pass
+    return df
+
+def load_coin_history():
+    return _load_coin_raw().copy(deep=False)
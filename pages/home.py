@@ -1,58 +1,14 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine
 from datetime import timedelta
-
-# ── RDS 연결 (secrets.toml) ─────────────────────────────────────
-user     = st.secrets['DB']['DB_USER']
-password = st.secrets['DB']['DB_PASSWORD']
-host     = st.secrets['DB']['DB_HOST']
-port     = st.secrets['DB']['DB_PORT']
-db       = st.secrets['DB']['DB_NAME']
-
-engine = create_engine(
-    f"mysql+pymysql://{user}:{password}@{host}:{port}/{db}?charset=utf8mb4",
-    pool_recycle=3600,
-    connect_args={"connect_timeout": 10}
-)
-
-# ── 데이터 로드 함수 정의 ─────────────────────────────────────────
-@st.cache_data
-def load_payment_data():
-    """
-    전체 결제 데이터 로드
-    """
-    sql = """
-    SELECT
-      `date`,
-      SUM(amount) AS amount
-    FROM payment_bomkr
-    GROUP BY `date`
-    """
-    df = pd.read_sql(sql, con=engine)
-    df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d', errors='coerce')
-    return df.dropna(subset=['date'])
-
-@st.cache_data
-def load_coin_data():
-    """
-    전체 코인 사용 데이터 로드
-    """
-    sql = """
-    SELECT date, Total_coins
-    FROM purchase_bomkr
-    """
-    df = pd.read_sql(sql, con=engine)
-    df['date']        = pd.to_datetime(df['date'], errors='coerce')
-    df['Total_coins'] = pd.to_numeric(df['Total_coins'], errors='coerce').fillna(0).astype(int)
-    return df.dropna(subset=['date'])
+from db import load_daily_payment, load_coin_history
 
 # ── 홈 요약 페이지 ───────────────────────────────────────────────
 st.title("🏠 홈 요약 대시보드")
 
 # 데이터 불러오기
-pay_df  = load_payment_data()
-coin_df = load_coin_data()
+pay_df  = load_daily_payment()
+coin_df = load_coin_history()
 
 # 요약 지표 계산
 total_pay  = int(pay_df['amount'].sum())